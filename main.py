@@ -1,16 +1,20 @@
 import csv
-import os
+import io
 import re
+from array import array
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from datetime import datetime
 from pathlib import Path
 from random import sample
 from sys import argv
 from typing import cast
 
+import ahocorasick  # ty: ignore[unresolved-import]
 import niquests
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import zhconv
 from slugify import slugify
 
@@ -48,6 +52,8 @@ QUESTIONNAIRE: list[str] = [
 NAME_PREPROCESS = re.compile(r'[\(\)（）【】#]')
 FILENAME_PREPROCESS = re.compile(r'[/>|:&]')
 NORMAL_NAME_MATCHER = re.compile(r'大学|学院|学校')
+ILLEGAL_FILENAME = re.compile(r'[\\/:*?"<>|\0]')
+MARKDOWN_ESCAPE = str.maketrans({'*': '\\*', '~': '\\~', '_': '\\_'})
 
 ROOT = Path('required')
 SITE_DIR = Path(r'D:\Project\questionnaire-report-theme')
@@ -73,7 +79,7 @@ DOC_URL = BASE_URL + 'site/docs/choose-a-college/'
 
 
 # ================== 数据类 ==================
-@dataclass
+@dataclass(slots=True)
 class IndexedContent:
     answer_id: int
     content: str
@@ -82,18 +88,17 @@ class IndexedContent:
         return f'A{self.answer_id}: {self.content}'
 
 
-@dataclass
+@dataclass(slots=True)
 class AnswerGroup:
-    answers: list[IndexedContent] = field(default_factory=list)
+    ids: array = field(default_factory=lambda: array('i'))
+    contents: list[str] = field(default_factory=list)
 
-    def add_answer(self, ans: IndexedContent) -> None:
-        self.answers.append(ans)
+    def add_answer(self, answer_id: int, content: str) -> None:
+        self.ids.append(answer_id)
+        self.contents.append(content)
 
-    def extend(self, other: 'AnswerGroup') -> None:
-        self.answers.extend(other.answers)
 
-
-@dataclass
+@dataclass(slots=True)
 class University:
     answers: list[AnswerGroup] = field(
         default_factory=lambda: [AnswerGroup() for _ in range(len(QUESTIONNAIRE))]
@@ -101,8 +106,8 @@ class University:
     additional_answers: list[IndexedContent] = field(default_factory=list)
     credits: list[IndexedContent] = field(default_factory=list)
 
-    def add_answer(self, index: int, answer: IndexedContent) -> None:
-        self.answers[index].add_answer(answer)
+    def add_answer(self, index: int, answer_id: int, content: str) -> None:
+        self.answers[index].add_answer(answer_id, content)
 
     def add_additional_answer(self, answer: IndexedContent) -> None:
         if answer.content:
@@ -112,21 +117,27 @@ class University:
         self.credits.append(credit)
 
     def combine_from(self, other: 'University') -> None:
-        for mine, other_group in zip(self.answers, other.answers, strict=True):
-            mine.extend(other_group)
+        for mine, theirs in zip(self.answers, other.answers, strict=True):
+            mine.ids.extend(theirs.ids)
+            mine.contents.extend(theirs.contents)
         self.additional_answers.extend(other.additional_answers)
         self.credits.extend(other.credits)
 
 
 class FilenameMap:
-    def __init__(self) -> None:
+    def __init__(self, bases: dict[str, str] | None = None) -> None:
         self.mapping: dict[str, str] = {}
         self.used: set[str] = set()
+        # slugify 的结果可在多个 FilenameMap 间共享，去重编号仍各自独立
+        self.bases: dict[str, str] = {} if bases is None else bases
 
     def __getitem__(self, name: str) -> str:
         if name in self.mapping:
             return self.mapping[name]
-        base = slugify(FILENAME_PREPROCESS.sub('', name))
+        base = self.bases.get(name)
+        if base is None:
+            base = slugify(FILENAME_PREPROCESS.sub('', name))
+            self.bases[name] = base
         slug = base
         idx = 1
         while slug in self.used:
@@ -138,24 +149,28 @@ class FilenameMap:
 
 
 # ================== 辅助函数（简体中文注释） ==================
-def download_files(names: list[str], base_url: str, root: Path) -> None:
-    """下载缺失的文件到 root 目录"""
+def download_files(
+    session: niquests.Session, names: list[str], base_url: str, root: Path
+) -> None:
+    """下载缺失的文件到 root 目录，请求通过 HTTP/2 多路复用并发发出"""
     root.mkdir(parents=True, exist_ok=True)
+    responses = {}
     for name in names:
-        local_file = root / name
-        if not local_file.exists():
+        if not (root / name).exists():
             url = base_url + name
             print(f'Downloading {name} from {url}...')
-            r = niquests.get(url)
-            if r.status_code == 200:
-                local_file.write_bytes(cast(bytes, r.content))
-                print(f'Saved {name}')
-            else:
-                print(f'Failed to download {name}, status code: {r.status_code}')
+            responses[name] = session.get(url)
+    session.gather()
+    for name, r in responses.items():
+        if r.status_code == 200:
+            (root / name).write_bytes(cast(bytes, r.content))
+            print(f'Saved {name}')
+        else:
+            print(f'Failed to download {name}, status code: {r.status_code}')
 
 
 def markdown_escape(text: str) -> str:
-    return text.replace('*', '\\*').replace('~', '\\~').replace('_', '\\_')
+    return text.translate(MARKDOWN_ESCAPE)
 
 
 def generate_markdown_path(province: str, university_name: str, archived: bool) -> Path:
@@ -166,23 +181,54 @@ def generate_markdown_path(province: str, university_name: str, archived: bool)
     return base / 'universities' / province / f'{university_name}.md'
 
 
-def load_colleges() -> tuple[dict[str, list], dict[str, str]]:
+def load_colleges() -> tuple[dict[str, list], dict[str, str], ahocorasick.Automaton]:
     provinces: dict[str, list] = {}
     colleges: dict[str, str] = {}
     csv_path = ROOT / 'colleges.csv'
     if not csv_path.exists():
         raise FileNotFoundError('colleges.csv not found')
-    with csv_path.open('r', encoding='utf-8') as f:
+    with csv_path.open('r', encoding='utf-8', newline='') as f:
         reader = csv.reader(f)
         for province, college in reader:
             key = NAME_PREPROCESS.sub('', college).replace(' ', '')
             colleges[key] = province
             provinces.setdefault(province, [])
     provinces.setdefault('其他', [])
-    return provinces, colleges
+    automaton = ahocorasick.Automaton()
+    for key, prov in colleges.items():
+        automaton.add_word(key, (len(key), prov))
+    automaton.make_automaton()
+    return provinces, colleges, automaton
+
+
+def read_results(path: Path) -> pa.Table:
+    """用 PyArrow 读取问卷结果，编号直接解析为整数，其余列保持字符串"""
+    # 自由填写的回答可能含有换行
+    parse_options = pacsv.ParseOptions(newlines_in_values=True)
+    with pa.memory_map(str(path)) as source:
+        names = pacsv.open_csv(source, parse_options=parse_options).schema.names
+        column_types = dict.fromkeys(names, pa.string())
+        column_types[names[0]] = pa.int32()
+        source.seek(0)
+        table = pacsv.read_csv(
+            source,
+            parse_options=parse_options,
+            convert_options=pacsv.ConvertOptions(column_types=column_types),
+        )
+    # 与文本模式读取一致，把字段内的 \r\n 和单独的 \r 统一为 \n
+    newline_options = pc.ReplaceSubstringOptions(r'\r\n?', '\n')
+    columns = [
+        pc.call_function('replace_substring_regex', [column], newline_options)
+        if pa.types.is_string(column.type)
+        else column
+        for column in table.columns
+    ]
+    return pa.table(columns, names=table.column_names)
 
 
-def load_to_universities(universities: defaultdict[str, University], row: list) -> None:
+def load_to_universities(
+    universities: defaultdict[str, University], row: tuple
+) -> None:
     """把一行问卷记录加载到 universities 字典"""
     aid, _, anonymous, email, show_email, name, *answers = row[:-9]
     additional_answer = IndexedContent(int(aid), row[-9])
@@ -191,19 +237,31 @@ def load_to_universities(universities: defaultdict[str, University], row: list)
     name = zhconv.convert(name, 'zh-cn')
     name = NAME_PREPROCESS.sub('', name).strip()
     uni = universities[name]
-    submit_time = datetime.strptime(row[-8], '%Y-%m-%d %H:%M:%S')
+    submit_time = row[-8]
+    credit_month = f'{submit_time[:4]} 年 {submit_time[5:7]} 月'
     credit_text = (
-        f'{email} ({submit_time:%Y 年 %m 月})'
+        f'{email} ({credit_month})'
         if show_email_flag and email
-        else f'匿名 ({submit_time:%Y 年 %m 月})'
+        else f'匿名 ({credit_month})'
     )
     uni.add_credit(IndexedContent(int(aid), credit_text))
     for i, ans in enumerate(answers):
-        uni.add_answer(i, IndexedContent(int(aid), ans))
+        uni.add_answer(i, int(aid), ans)
     uni.add_additional_answer(additional_answer)
 
 
-def process_universities(universities: dict, colleges: dict) -> None:
+def load_whitelist() -> set[str]:
+    """读取白名单，活跃与归档两次处理共用"""
+    wl = ROOT / 'whitelist.txt'
+    if not wl.exists():
+        return set()
+    with wl.open('r', encoding='utf-8') as f:
+        return {line.strip() for line in f}
+
+
+def process_universities(
+    universities: dict, colleges: dict, whitelist: set[str]
+) -> None:
     """处理别名、黑名单与可能无效的名称提示"""
     alias_path = ROOT / 'alias.txt'
     if alias_path.exists():
@@ -224,12 +282,6 @@ def process_universities(universities: dict, colleges: dict) -> None:
         with blacklist.open('r', encoding='utf-8') as f:
             for line in f:
                 universities.pop(line.strip(), None)
-    wl = ROOT / 'whitelist.txt'
-    whitelist = (
-        {l.strip() for l in wl.read_text(encoding='utf-8').splitlines()}
-        if wl.exists()
-        else set()
-    )
     for name in list(universities.keys()):
         if NORMAL_NAME_MATCHER.search(name) is None and name not in whitelist:
             print(
@@ -250,68 +302,70 @@ def ensure_dirs() -> None:
 
 def sanitize_filename(filename: str) -> tuple[str, bool]:
     """清理文件名中的非法字符并判断是否被替换"""
-    illegal_pattern = r'[\\/:*?"<>|\0]'
-    cleaned = re.sub(illegal_pattern, '_', str(filename))
+    cleaned = ILLEGAL_FILENAME.sub('_', filename)
     return cleaned, cleaned != filename
 
 
-def find_province(name: str, colleges: dict[str, str]) -> str:
-    for key, prov in colleges.items():
-        if name.find(key) >= 0:
-            return prov
-    return '其他'
+def find_province(name: str, automaton: ahocorasick.Automaton) -> str:
+    """用 Aho-Corasick 自动机一次扫描名称，返回最长命中学校名对应的省份"""
+    best_len, best_prov = 0, '其他'
+    for _, (length, prov) in automaton.iter(name):
+        if length > best_len:
+            best_len, best_prov = length, prov
+    return best_prov
 
 
 def render_university_markdown(
     name: str, uni: University, slug: str, archived: bool
-) -> str:
-    lines: list[str] = [
-        '---\n',
-        f'title: "{name}{" (已归档)" if archived else ""}"\n',
-        f'slug: "{slug}"\n',
-        f'description: 来自 colleges.chat 的{name} 问卷调查信息\n',
-        '---\n\n',
-    ]
-    lines.append('> 本页面内容来源于问卷，仅供参考。\n\n')
-    lines.append('> 数据来源：\n<details><summary>展开</summary>\n<ul>\n')
+) -> bytes:
+    buf = io.StringIO()
+    buf.write('---\n')
+    buf.write(f'title: "{name}{" (已归档)" if archived else ""}"\n')
+    buf.write(f'slug: "{slug}"\n')
+    buf.write(f'description: 来自 colleges.chat 的{name} 问卷调查信息\n')
+    buf.write('---\n\n')
+    buf.write('> 本页面内容来源于问卷，仅供参考。\n\n')
+    buf.write('> 数据来源：\n<details><summary>展开</summary>\n<ul>\n')
     for c in uni.credits:
-        lines.append(f'<li>{c}</li>\n')
-    lines.append('</ul>\n</details>\n\n')
+        buf.write(f'<li>{c}</li>\n')
+    buf.write('</ul>\n</details>\n\n')
     for q, group in zip(QUESTIONNAIRE, uni.answers, strict=True):
-        lines.append(f'## Q: {q}\n\n')
-        for ans in group.answers:
-            lines.append(f'- {markdown_escape(str(ans))}\n')
+        buf.write('## Q: ')
+        buf.write(q)
+        buf.write('\n\n')
+        for aid, content in zip(group.ids, group.contents):
+            buf.write(f'- A{aid}: ')
+            buf.write(markdown_escape(content))
+            buf.write('\n')
     if uni.additional_answers:
-        lines.append('\n## 自由补充\n\n')
+        buf.write('\n## 自由补充\n\n')
         for a in uni.additional_answers:
-            lines.append(markdown_escape(str(a)) + '\n\n')
-    return ''.join(lines)
+            buf.write(markdown_escape(str(a)))
+            buf.write('\n\n')
+    return buf.getvalue().encode('utf-8')
 
 
-def write_university_markdown(
-    name: str,
-    uni: University,
-    slug: str,
-    target: Path,
-    archived: bool,
-) -> None:
-    target.write_text(
-        render_university_markdown(name, uni, slug, archived), encoding='utf-8'
-    )
+def render_task(task: tuple[str, University, str, bool]) -> bytes:
+    """进程池的渲染入口，只接收可 pickle 的参数元组"""
+    return render_university_markdown(*task)
+
+
+def write_university_markdown(target: Path, payload: bytes) -> None:
+    target.write_bytes(payload)
 
 
 def write_markdown_for_universities(
     universities: dict[str, University],
     filename_map: FilenameMap,
-    colleges: dict[str, str],
+    province_of: dict[str, str],
     archived: bool,
+    executor: ProcessPoolExecutor,
 ) -> None:
-    """把 universities 并发写成 Hugo 的 markdown 页面"""
+    """把 universities 写成 Hugo 的 markdown 页面：多进程渲染，主线程写入"""
     tasks: list[tuple[str, University, str, Path]] = []
     for name, uni in universities.items():
         slug = filename_map[name]
-        province = find_province(name, colleges)
-        target = generate_markdown_path(province, name, archived)
+        target = generate_markdown_path(province_of[name], name, archived)
         target_name, is_illegal = sanitize_filename(target.stem)
         if is_illegal:
             print(f'[error] {target} 文件名可能非法！')
@@ -320,73 +374,110 @@ def write_markdown_for_universities(
 
     for parent in {target.parent for _, _, _, target in tasks}:
         parent.mkdir(parents=True, exist_ok=True)
-        (parent / '_index.md').touch()
+        index = parent / '_index.md'
+        if not index.exists():
+            index.write_bytes(b'')
 
-    max_workers = min(32, max(1, (os.cpu_count() or 1) * 4))
     section = 'archived' if archived else 'active'
     total = len(tasks)
     print(f'[info] Start generating {section} markdown files: {total}')
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(
-                write_university_markdown, name, uni, slug, target, archived
-            )
-            for name, uni, slug, target in tasks
-        ]
-        completed = 0
-        for future in as_completed(futures):
-            future.result()
-            completed += 1
-            progress = completed / total * 100 if total else 100.0
-            print(
-                f'\r[progress] {section}: {completed}/{total} ({progress:.1f}%)',
-                end='',
-                flush=True,
-            )
-    print()
-
-
-ensure_dirs()
-download_files(REQUIRED_FILES, BASE_URL, ROOT)
-download_files(
-    REQUIRED_DOCS, DOC_URL, SITE_DIR / 'content' / 'docs' / 'choose-a-college'
-)
-download_files(['index.md'], BASE_URL + '/site/docs/', SITE_DIR / 'content' / 'docs')
-
-target_file = SITE_DIR / 'content' / 'docs' / 'index.md'
-new_file = target_file.with_name('_index.md')
-target_file.rename(new_file)
-header = '---\ntitle: 首页\nurl: /\n---\n\n'
-content = new_file.read_text(encoding='utf-8')
-new_file.write_text(header + content, encoding='utf-8')
-
-provinces, colleges = load_colleges()
-archive_cut = datetime.strptime(ARCHIVE_TIME, '%Y-%m-%d %H:%M:%S')
-
-universities: defaultdict[str, University] = defaultdict(University)
-universities_archived: defaultdict[str, University] = defaultdict(University)
-
-with (ROOT / 'results_desensitized.csv').open('r', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    next(reader, None)
-    for row in reader:
-        t = datetime.strptime(row[-8], '%Y-%m-%d %H:%M:%S')
-        target = universities_archived if t < archive_cut else universities
-        load_to_universities(target, row)
-
-if 'debug' in argv:
-    universities: dict[str, University] = dict(sample(list(universities.items()), 100))
-    universities_archived: dict[str, University] = dict(
-        sample(list(universities_archived.items()), 100)
-    )
-    print(
-        f'Debug mode: only processing 100 universities each <{len(universities)} and {len(universities_archived)} >.'
+    rendered = executor.map(
+        render_task,
+        [(name, uni, slug, archived) for name, uni, slug, _ in tasks],
+        chunksize=64,
     )
-process_universities(universities, colleges)
-process_universities(universities_archived, colleges)
+    for completed, ((_, _, _, target), payload) in enumerate(
+        zip(tasks, rendered), start=1
+    ):
+        write_university_markdown(target, payload)
+        progress = completed / total * 100 if total else 100.0
+        print(
+            f'\r[progress] {section}: {completed}/{total} ({progress:.1f}%)',
+            end='',
+            flush=True,
+        )
+    print()
 
 
-write_markdown_for_universities(universities, FilenameMap(), colleges, archived=False)
-write_markdown_for_universities(
-    universities_archived, FilenameMap(), colleges, archived=True
-)
+def main() -> None:
+    ensure_dirs()
+    # 所有文件来自同一主机，共用一个会话以复用连接
+    with niquests.Session(multiplexed=True) as session:
+        download_files(session, REQUIRED_FILES, BASE_URL, ROOT)
+        download_files(
+            session,
+            REQUIRED_DOCS,
+            DOC_URL,
+            SITE_DIR / 'content' / 'docs' / 'choose-a-college',
+        )
+        download_files(
+            session,
+            ['index.md'],
+            BASE_URL + '/site/docs/',
+            SITE_DIR / 'content' / 'docs',
+        )
+
+    target_file = SITE_DIR / 'content' / 'docs' / 'index.md'
+    new_file = target_file.with_name('_index.md')
+    target_file.rename(new_file)
+    header = '---\ntitle: 首页\nurl: /\n---\n\n'
+    content = new_file.read_text(encoding='utf-8')
+    new_file.write_text(header + content, encoding='utf-8')
+
+    provinces, colleges, automaton = load_colleges()
+
+    universities: defaultdict[str, University] = defaultdict(University)
+    universities_archived: defaultdict[str, University] = defaultdict(University)
+
+    results = read_results(ROOT / 'results_desensitized.csv')
+    for batch in results.to_batches():
+        # 时间为定宽的 ISO 格式字符串，字典序即时间顺序，无需解析
+        archived_mask = pc.call_function(
+            'less', [batch.column(batch.num_columns - 8), ARCHIVE_TIME]
+        )
+        columns = [column.to_pylist() for column in batch.columns]
+        for is_archived, row in zip(archived_mask.to_pylist(), zip(*columns)):
+            target = universities_archived if is_archived else universities
+            load_to_universities(target, row)
+
+    if 'debug' in argv:
+        universities: dict[str, University] = {
+            k: universities[k] for k in sample(list(universities), 100)
+        }
+        universities_archived: dict[str, University] = {
+            k: universities_archived[k]
+            for k in sample(list(universities_archived), 100)
+        }
+        print(
+            f'Debug mode: only processing 100 universities each <{len(universities)} and {len(universities_archived)} >.'
+        )
+    whitelist = load_whitelist()
+    process_universities(universities, colleges, whitelist)
+    process_universities(universities_archived, colleges, whitelist)
+
+    # 两批名称大量重叠，省份只查一次
+    province_of = {
+        name: find_province(name, automaton)
+        for name in universities.keys() | universities_archived.keys()
+    }
+    slug_bases: dict[str, str] = {}
+    # 两个分区共用一个进程池，避免重复启动子进程
+    with ProcessPoolExecutor() as executor:
+        write_markdown_for_universities(
+            universities,
+            FilenameMap(slug_bases),
+            province_of,
+            archived=False,
+            executor=executor,
+        )
+        write_markdown_for_universities(
+            universities_archived,
+            FilenameMap(slug_bases),
+            province_of,
+            archived=True,
+            executor=executor,
+        )
+
+
+if __name__ == '__main__':
+    main()